@@ -1,35 +1,172 @@
+"""
+Background execution of postponed calls.
+
+The worker thread is started lazily on the first postponed call, and restarted
+in forked children (detected by a PID change), so the module is safe to import
+before preforking servers such as gunicorn --preload.
+"""
 import atexit
 import Queue
 import threading
 import functools
+import logging
+import os
+import time
+
+LOG = logging.getLogger(__name__)
+
+# Default time (in seconds) to wait for pending jobs at exit; None waits for all of them
+DRAIN_TIMEOUT = None
+
+# Locks guarding worker startup/shutdown, one per PID. A lock held by another
+# thread at the moment of a fork is inherited locked with nobody left to
+# release it, so each process uses its own (see _get_lock).
+_locks = {}
+# (pid, queue, thread) of the current worker, kept in a single global so that
+# the PID and the queue are always read together
+_state = (None, None, None)
+_atexit_registered = False
+_stop = object()
 
-from django.core.mail import mail_admins
+class _QueueStopped(Exception):
+    pass
 
-def _worker():
+class _JobQueue(Queue.Queue):
+    """
+    Job queue that refuses new jobs once the stop marker has been put, so that
+    no job can be queued behind it and silently lost.
+    """
+    stopped = False
+
+    def _put(self, item):
+        # called with the queue mutex held, so the check and the put are atomic
+        if self.stopped:
+            raise _QueueStopped()
+        Queue.Queue._put(self, item)
+        if item is _stop:
+            self.stopped = True
+
+def _worker(queue):
+    from django.core.mail import mail_admins
     while True:
-        func, args, kwargs = _queue.get()
+        item = queue.get()
         try:
+            if item is _stop:
+                return
+            func, args, kwargs = item
             func(*args, **kwargs)
         except:
             import traceback
             details = traceback.format_exc()
             mail_admins('Background process exception', details)
         finally:
-            _queue.task_done()  # so we can join at exit
+            queue.task_done()  # so we can join at exit
+
+def _get_lock():
+    """
+    Returns the lock of the current process. dict.setdefault is atomic, so all
+    threads of a forked child agree on the same new lock.
+    """
+    pid = os.getpid()
+    lock = _locks.get(pid)
+    if lock is None:
+        lock = _locks.setdefault(pid, threading.Lock())
+    return lock
+
+def _get_queue():
+    """
+    Returns the job queue of the current process, starting its worker thread
+    if this is the first call, or the first one after a fork.
+    """
+    global _state, _atexit_registered
+    pid = os.getpid()
+    state = _state
+    if state[0] == pid:
+        return state[1]
+    with _get_lock():
+        if _state[0] != pid:
+            # jobs queued by the parent are still run by the parent's own worker
+            queue = _JobQueue()
+            thread = threading.Thread(target=_worker, args=(queue,))
+            thread.daemon = True
+            thread.start()
+            _state = (pid, queue, thread)
+            if not _atexit_registered:
+                # the hook is inherited by forked children, so one registration is enough
+                atexit.register(_atexit)
+                _atexit_registered = True
+        return _state[1]
 
 def postpone(f):
     @functools.wraps(f)
     def wrapper (*args, **kwargs):
-        _queue.put((f, args, kwargs))
+        while True:
+            try:
+                _get_queue().put((f, args, kwargs))
+                return
+            except _QueueStopped:
+                # the worker was shut down meanwhile; the next call starts a new one
+                pass
     return wrapper
 
+def _drain(queue, timeout):
+    """
+    Waits for all jobs in the queue to finish, for up to timeout seconds.
+    Returns the number of jobs that are still pending.
+    """
+    if timeout is None:
+        queue.join()
+        return 0
+    deadline = time.time() + timeout
+    with queue.all_tasks_done:
+        while queue.unfinished_tasks:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            queue.all_tasks_done.wait(remaining)
+        return queue.unfinished_tasks
 
-_queue = Queue.Queue()
-_thread = threading.Thread(target=_worker)
-_thread.daemon = True
-_thread.start()
+def _cleanup(timeout=None):
+    """
+    Waits for the pending jobs (for up to timeout seconds, if given), so we
+    don't exit too soon. Does nothing if the worker was never started in this process.
+    """
+    pid, queue, thread = _state
+    if pid != os.getpid():
+        return
+    pending = _drain(queue, timeout)
+    if pending:
+        LOG.warning(u'Exiting with %d postponed job(s) still pending' % pending)
 
-def _cleanup():
-    _queue.join()   # so we don't exit too soon
+def shutdown(timeout=None):
+    """
+    Gracefully stops the worker of the current process, waiting up to timeout
+    seconds for the pending jobs. A later postponed call starts a new worker.
+    """
+    global _state
+    if _state[0] != os.getpid():
+        # never started in this process
+        return
+    with _get_lock():
+        pid, queue, thread = _state
+        if pid != os.getpid():
+            return
+        _state = (None, None, None)
+    queue.put(_stop)
+    start = time.time()
+    # the stop marker itself is counted as an unfinished task
+    pending = max(0, _drain(queue, timeout) - 1)
+    if pending:
+        LOG.warning(u'Worker shut down with %d postponed job(s) still pending' % pending)
+    else:
+        thread.join(None if timeout is None else max(0, timeout - (time.time() - start)))
 
-atexit.register(_cleanup)
\ No newline at end of file
+def _atexit():
+    from django.conf import settings
+    from django.core.exceptions import ImproperlyConfigured
+    try:
+        timeout = getattr(settings, 'RPCENABLE_ASYNC_DRAIN_TIMEOUT', DRAIN_TIMEOUT)
+    except ImproperlyConfigured:
+        # used outside of a configured Django project; still wait for the jobs
+        timeout = DRAIN_TIMEOUT
+    _cleanup(timeout)
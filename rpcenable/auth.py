@@ -14,7 +14,7 @@ from django.utils.importlib import import_module
 from django.conf import settings
 
 from rpcenable.models import APIUser
-from rpcenable.registry import XMLRPCPoint
+from rpcenable.registry import XMLRPCPoint, LoopbackPoint
 from xmlrpclib import Fault
 
 NONCE_MIN_LEN = 16
@@ -146,3 +146,14 @@ class AuthXMLRPCPoint(XMLRPCPoint):
         kwargs['param_hook'] = lambda x: generate_auth_args(user, secret) + x
         kwargs['allow_none'] = True
         return XMLRPCPoint.__init__(self, *args, **kwargs)   # old-style inheritance
+
+class AuthLoopbackPoint(LoopbackPoint):
+    """
+    Loopback point for authenticated in-process calls,
+
+    Prepends the authentication arguments returned by
+    `generate_auth_args(user, secret)` just like AuthXMLRPCPoint does
+    """
+    def __init__ (self, user, secret, *args, **kwargs):
+        kwargs['param_hook'] = lambda x: generate_auth_args(user, secret) + x
+        LoopbackPoint.__init__(self, *args, **kwargs)
@@ -122,24 +122,95 @@ class CustomCGIXMLRPCRequestHandler (CGIXMLRPCRequestHandler):
 
         return HttpResponse(response, mimetype='text/xml')
 
+    def log_handle_local_call (self, method, params, prefix = '', marshal = False):
+        """
+        Same as handle_local_call, but logs the call as a new IncomingRequest
+        instance, just like log_handle_django_request does for HTTP calls.
+        """
+        start = time.time()
+        ir = IncomingRequest()
+        ir.prefix = prefix
+        ir.params, ir.method = params, method
+        try:
+            return self._local_dispatch(method, params, marshal=marshal, ir=ir)
+        finally:
+            ir.completion_time = Decimal(str(time.time() - start)) # compatibility with 2.6, where Decimal can't accept float
+            ir.save()
+
+    def handle_local_call (self, method, params, marshal = False):
+        """
+        Dispatches an already unmarshalled call, skipping HTTP and XML entirely.
+        """
+        return self._local_dispatch(method, params, marshal=marshal)
+
+    def _local_dispatch (self, method, params, marshal = False, ir = None):
+        """
+        In-process counterpart of _marshaled_dispatch. Faults are raised as-is and
+        any other exception is turned into Fault(1, ...), the same way it would be
+        reported over the wire. With marshal=True the result is round-tripped
+        through xmlrpclib, so unmarshallable values fail and types change (e.g.
+        tuples become lists, faults lose their subclass) exactly as over HTTP.
+        """
+        try:
+            response = self._dispatch(method, params)
+            if marshal:
+                response = xmlrpclib.dumps((response,), methodresponse=1,
+                                           allow_none=self.allow_none, encoding=self.encoding)
+                response = xmlrpclib.loads(response)[0][0]
+            return response
+        except xmlrpclib.Fault, fault:
+            if marshal:
+                # plain Fault instance, as the remote side would see it
+                raise xmlrpclib.Fault(fault.faultCode, fault.faultString)
+            raise
+        except Exception, e:
+            exc_type, exc_value, exc_tb = sys.exc_info()
+            if ir:
+                LOG.exception (u'Exception in loopback XMLRPC call: %s' % e)
+                lines = traceback.format_exception(exc_type, exc_value, exc_tb)
+                ir.exception = ''.join(lines)
+            raise xmlrpclib.Fault(1, "%s:%s" % (exc_type, exc_value))
+
 
 class RPCRegistry (object):
     """
-    Central registry that keeps track of/exposes all rpc-enabled functions
+    Central registry that keeps track of/exposes all rpc-enabled functions.
+
+    Any of the constructor arguments left as None is read from the corresponding
+    RPCENABLE_* setting on first use, rather than when the registry is created.
     """
-    def __init__ (self,  logging, allow_none, encoding):
+    def __init__ (self,  logging=None, allow_none=None, encoding=None):
+        self.logging = logging
         self.allow_none = allow_none
         self.encoding = encoding
-        self.reg = {'': CustomCGIXMLRPCRequestHandler(allow_none=allow_none, encoding=encoding)}
-        self.reg[''].register_introspection_functions()
-        self.logging = logging
+        self._reg = None
+
+    def _configure (self):
+        """Fills in the options not given to the constructor from settings.py"""
+        if self.logging is None:
+            self.logging = getattr(settings, 'RPCENABLE_LOG_INCOMING',False)
+        if self.allow_none is None:
+            self.allow_none = getattr(settings, 'RPCENABLE_ALLOW_NONE',True)
+        if self.encoding is None:
+            self.encoding = getattr(settings, 'RPCENABLE_ENCODING',None)
+
+    @property
+    def reg (self):
+        if self._reg is None:
+            self._configure()
+            self._reg = {'': self._make_handler()}
+        return self._reg
+
+    def _make_handler (self):
+        handler = CustomCGIXMLRPCRequestHandler(allow_none=self.allow_none, encoding=self.encoding)
+        handler.register_introspection_functions()
+        return handler
 
     def _add_function (self, function, prefix, name=None):
         r = self.reg.get(prefix)
         if not r:
             # create the prefix on the fly
-            self.reg[prefix] = CustomCGIXMLRPCRequestHandler(allow_none=self.allow_none, encoding=self.encoding)
-            self.reg[prefix].register_introspection_functions()
+            self.reg[prefix] = self._make_handler()
         # register the decorated function, and return it with no changes
         self.reg[prefix].register_function(function, name)
 
@@ -169,11 +240,8 @@ class RPCRegistry (object):
             return self.reg[prefix].log_handle_django_request(request, prefix)
         return self.reg[prefix].handle_django_request(request)
 
-# Instantiate the registry
-rpcregistry = RPCRegistry(logging = getattr(settings, 'RPCENABLE_LOG_INCOMING',False),
-                          allow_none= getattr(settings, 'RPCENABLE_ALLOW_NONE',True),
-                          encoding = getattr(settings, 'RPCENABLE_ENCODING',None),
-                          )
+# Instantiate the registry; settings are read on first use
+rpcregistry = RPCRegistry()
 
 class XMLRPCPoint (xmlrpclib.ServerProxy):
     """
@@ -230,3 +298,41 @@ class XMLRPCPoint (xmlrpclib.ServerProxy):
         return result
 
 
+class LoopbackPoint (object):
+    """
+    In-process counterpart of XMLRPCPoint, for calling functions exposed by
+    a local RPCRegistry. Calls are dispatched straight into the registered
+    functions, without any HTTP round trip or XML marshalling, while keeping
+    the fault semantics of the XMLRPC view. Incoming calls are logged if the
+    registry has logging enabled.
+
+    The constructor takes the registry prefix to call into, and the same
+    optional param_hook keyword argument as XMLRPCPoint. Passing marshal=True
+    round-trips params and results through xmlrpclib, so that behavior
+    (accepted types, returned types) matches the wire exactly.
+    """
+    def __init__ (self, prefix = '', registry = None, param_hook = None, marshal = False):
+        self.__prefix = prefix
+        self.__registry = registry or rpcregistry
+        self.__param_hook = param_hook or (lambda x:x)
+        self.__marshal = marshal
+
+    def __request(self, methodname, params):
+        mod_params = self.__param_hook(params)
+        handler = self.__registry.reg.get(self.__prefix)
+        if handler is None:
+            # the view responds with HTTP 400 for unknown prefixes
+            raise xmlrpclib.ProtocolError('loopback:%s' % self.__prefix, 400, 'Unknown XMLRPC prefix', {})
+        if self.__marshal:
+            data = xmlrpclib.dumps(tuple(mod_params), methodname,
+                                   allow_none=handler.allow_none, encoding=handler.encoding)
+            mod_params, methodname = xmlrpclib.loads(data)
+        if self.__registry.logging:
+            return handler.log_handle_local_call(methodname, mod_params, self.__prefix, marshal=self.__marshal)
+        return handler.handle_local_call(methodname, mod_params, marshal=self.__marshal)
+
+    def __getattr__(self, name):
+        if not name.startswith('__'):
+            # magic method dispatcher
+            return xmlrpclib._Method(self.__request, name)
+        raise AttributeError("Attribute %r not found" % (name,))
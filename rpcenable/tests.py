@@ -7,6 +7,7 @@ Replace this with more appropriate tests for your application.
 import threading
 import time
 import os
+import signal
 
 from django.test import TestCase
 from django.test.utils import override_settings
@@ -16,9 +17,12 @@ from django.conf import settings
 
 from rpcenable.abstractmodels import BaseAPIUser, APIUserAdmin, SampleUser
 from rpcenable import async, auth
+from rpcenable.registry import RPCRegistry, LoopbackPoint
+from rpcenable.models import IncomingRequest
 
 from django.db import models
 from django.core.mail import mail_admins
+from xmlrpclib import Fault, ProtocolError
 
 def wait_threads():
     for thread in threading.enumerate():
@@ -54,6 +58,131 @@ class AsycTest(TestCase):
         self.assertEqual (len(mail.outbox), 1)
         self.assertItemsEqual(mail.outbox[0].recipients(), [a[1] for a in settings.ADMINS])
 
+    def test_asyc_restart_after_fork (self):
+        @async.postpone
+        def test_func ():
+            mail.send_mail ('Async test', 'Async test', 'test@example.com', ['test@example.com'])
+        test_func()
+        old_pid, old_queue, old_thread = async._state
+        # pretend we are in a forked child: a new worker should be started
+        async._state = (-1, old_queue, old_thread)
+        test_func()
+        self.assertIsNot (async._state[2], old_thread)
+        self.assertEqual (async._state[0], os.getpid())
+        async._cleanup()
+        # stop the worker we have just orphaned
+        old_queue.put(async._stop)
+        old_thread.join()
+        self.assertEqual (len(mail.outbox), 2)
+
+    def _fork_and_postpone (self):
+        """
+        Forks a child that postpones a job and waits for it at exit.
+        Returns what the job reported back, or None if it never ran.
+        """
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(rfd)
+                # a deadlocked child gets killed instead of hanging the tests
+                signal.alarm(10)
+                @async.postpone
+                def report ():
+                    os.write(wfd, str(os.getpid()))
+                report()
+                async._cleanup()
+            finally:
+                os._exit(0)
+        os.close(wfd)
+        try:
+            data = os.read(rfd, 32)
+        finally:
+            os.close(rfd)
+        os.waitpid(pid, 0)
+        return pid, data or None
+
+    def test_asyc_fork (self):
+        # make sure the parent has a running worker, which the child does not inherit
+        async.postpone(lambda: None)()
+        pid, data = self._fork_and_postpone()
+        self.assertEqual (data, str(pid))
+
+    def test_asyc_fork_with_lock_held (self):
+        # a lock held by another thread at fork time must not deadlock the child
+        lock = async._get_lock()
+        lock.acquire()
+        try:
+            pid, data = self._fork_and_postpone()
+        finally:
+            lock.release()
+        self.assertEqual (data, str(pid))
+
+    def test_asyc_shutdown (self):
+        @async.postpone
+        def test_func (wait):
+            time.sleep(wait)
+        test_func(0)
+        thread = async._state[2]
+        async.shutdown()
+        self.assertFalse (thread.is_alive())
+        self.assertEqual (async._state, (None, None, None))
+        # next postponed call starts a new worker
+        test_func(0.5)
+        self.assertTrue (async._state[2].is_alive())
+        # drain timeout is respected
+        start_time = time.time()
+        async.shutdown(timeout=0.1)
+        self.assertLess (time.time() - start_time, 0.5)
+
+    def test_asyc_drain_timeout (self):
+        @async.postpone
+        def test_func (wait):
+            time.sleep(wait)
+        test_func(0.5)
+        start_time = time.time()
+        with override_settings(RPCENABLE_ASYNC_DRAIN_TIMEOUT=0.1):
+            async._atexit()
+        self.assertLess (time.time() - start_time, 0.5)
+        # without a timeout, all jobs are waited for
+        test_func(0.2)
+        async._atexit()
+        self.assertEqual (async._state[1].unfinished_tasks, 0)
+
+    def test_asyc_lock_per_process (self):
+        lock = async._get_lock()
+        self.assertIs (async._get_lock(), lock)
+        # all threads of a (pretend) forked child get the same, fresh lock
+        locks = []
+        threads = [threading.Thread(target=lambda: locks.append(async._get_lock()))
+                   for i in xrange(10)]
+        pid = os.getpid()
+        try:
+            del async._locks[pid]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            async._locks[pid] = lock
+        self.assertIsNot (locks[0], lock)
+        self.assertTrue (all(l is locks[0] for l in locks))
+
+    def test_asyc_postpone_after_stop (self):
+        @async.postpone
+        def test_func ():
+            mail.send_mail ('Async test', 'Async test', 'test@example.com', ['test@example.com'])
+        test_func()
+        pid, queue, thread = async._state
+        # a postpone racing with shutdown may still hold the stopped queue
+        queue.put(async._stop)
+        self.assertRaises (async._QueueStopped, queue.put, None)
+        async._state = (None, None, None)
+        test_func()
+        async._cleanup()
+        thread.join()
+        self.assertEqual (len(mail.outbox), 2)
+
 
 class AuthTest(TestCase):
     def setUp (self):
@@ -129,6 +258,64 @@ class AuthTest(TestCase):
         self.assertRaises (auth.AuthError, foo, *(details + (somevar,)))
 
 
+class LoopbackTest(TestCase):
+
+    def setUp (self):
+        self.user = auth.APIUser(username = 'u1', secret = 's1', active = True)
+        self.user.save()
+        self.registry = self._make_registry(logging=False)
+
+    def _make_registry (self, logging):
+        # a local registry, so that no test functions leak into rpcregistry
+        registry = RPCRegistry(logging=logging)
+        @registry.register_rpc(prefix='')
+        def lb_echo (var):
+            return var
+        @registry.register_rpc(prefix='')
+        def lb_fail ():
+            raise ValueError('Foo')
+        @registry.register_rpc(prefix='')
+        @auth.rpcauth
+        def lb_auth_echo (user, var):
+            return user.username, var
+        return registry
+
+    def test_call (self):
+        point = LoopbackPoint(registry=self.registry)
+        self.assertEqual (point.lb_echo((1, 2)), (1, 2))
+        self.assertIn ('lb_echo', point.system.listMethods())
+
+    def test_marshal (self):
+        point = LoopbackPoint(registry=self.registry, marshal=True)
+        # tuples come back as lists, just as over the wire
+        self.assertEqual (point.lb_echo((1, 2)), [1, 2])
+        self.assertRaises (TypeError, point.lb_echo, object())
+
+    def test_faults (self):
+        point = LoopbackPoint(registry=self.registry)
+        self.assertRaises (Fault, point.lb_fail)
+        self.assertRaises (Fault, point.lb_missing)
+        self.assertRaises (ProtocolError, LoopbackPoint('dummy', registry=self.registry).lb_echo, 1)
+
+    def test_auth (self):
+        point = auth.AuthLoopbackPoint('u1', 's1', registry=self.registry)
+        self.assertEqual (point.lb_auth_echo('Foo'), ('u1', 'Foo'))
+        point = auth.AuthLoopbackPoint('u1', 's1' + 'Dummy', registry=self.registry)
+        self.assertRaises (auth.AuthError, point.lb_auth_echo, 'Foo')
+        point = auth.AuthLoopbackPoint('u1', 's1' + 'Dummy', registry=self.registry, marshal=True)
+        self.assertRaises (Fault, point.lb_auth_echo, 'Foo')
+
+    def test_logging (self):
+        point = LoopbackPoint(registry=self._make_registry(logging=True))
+        self.assertEqual (point.lb_echo('Foo'), 'Foo')
+        self.assertRaises (Fault, point.lb_fail)
+        ok, failed = IncomingRequest.objects.order_by('id')
+        self.assertEqual (ok.method, 'lb_echo')
+        self.assertFalse (ok.exception)
+        self.assertEqual (failed.method, 'lb_fail')
+        self.assertIn ('ValueError', failed.exception)
+
+
 
 
 